@@ -0,0 +1,137 @@
+import asyncio
+import json
+import sys
+
+from websockets import ConnectionClosed
+from pydglab_ws import DGLabWSConnect, StrengthData, Channel, StrengthOperationType, RetCode
+from pydglab_ws.utils import PULSE_DATA_MAX_LENGTH, dump_add_pulses, dump_clear_pulses, dump_strength_operation
+
+from demo import (
+    get_host_ip,
+    print_qrcode,
+    PULSE_DATA,
+    CURRENT_WAVEFORM_A,
+    CURRENT_WAVEFORM_B,
+    WAVEFORM_SEND_INTERVAL,
+    CONNECTION_TIMEOUT
+)
+
+
+class BroadcastMember:
+    """广播组中的一个 App，持有各自的连接与手机强度上限"""
+
+    def __init__(self, client):
+        self.client = client
+        self.a_limit = 999  # 初始值，将从手机获取
+        self.b_limit = 999  # 初始值，将从手机获取
+        self._msg_prefix = None
+
+    @property
+    def msg_prefix(self):
+        """消息外层 JSON 中与本成员相关的部分，绑定后只生成一次"""
+        if self._msg_prefix is None:
+            self._msg_prefix = (f'{{"type":"msg","clientId":"{self.client.client_id}",'
+                                f'"targetId":"{self.client.target_id}","message":')
+        return self._msg_prefix
+
+    def get_limit(self, channel):
+        return self.a_limit if channel == Channel.A else self.b_limit
+
+    async def send_encoded(self, encoded_message: str):
+        """发送已经编码好的 message 字段"""
+        if self.client.not_bind:
+            return
+        try:
+            await self.client.websocket.send(self.msg_prefix + encoded_message + "}")
+        except ConnectionClosed:
+            pass
+
+
+class BroadcastGroup:
+    """
+    一对多广播组：同一个波形同时发送给多个 App
+
+    每块波形只序列化一次，所有成员复用同一份编码结果，只拼接各自的 ID
+    """
+
+    def __init__(self):
+        self.members = []
+
+    async def _send_all(self, message: str):
+        encoded_message = json.dumps(message, separators=(",", ":"))
+        await asyncio.gather(*(member.send_encoded(encoded_message) for member in self.members))
+
+    async def add_pulses(self, channel, pulse_data):
+        """分块发送波形，每块编码一次后发给所有成员"""
+        for i in range(0, len(pulse_data), PULSE_DATA_MAX_LENGTH):
+            await self._send_all(dump_add_pulses(channel, *pulse_data[i:i + PULSE_DATA_MAX_LENGTH]))
+            await asyncio.sleep(0.05)
+
+    async def clear_pulses(self, channel):
+        await self._send_all(dump_clear_pulses(channel))
+
+    async def set_strength(self, channel, strength):
+        """设置强度，每个成员按各自手机上限截断，相同的值只编码一次"""
+        encoded_cache = {}
+        sends = []
+        for member in self.members:
+            value = max(1, min(strength, member.get_limit(channel)))
+            if value not in encoded_cache:
+                encoded_cache[value] = json.dumps(
+                    dump_strength_operation(channel, StrengthOperationType.SET_TO, value)
+                )
+            sends.append(member.send_encoded(encoded_cache[value]))
+        await asyncio.gather(*sends)
+
+    async def watch_member(self, member):
+        """处理单个成员的消息：更新强度上限，App 断开后等待重新绑定"""
+        async for data in member.client.data_generator():
+            if isinstance(data, StrengthData):
+                if (data.a_limit, data.b_limit) != (member.a_limit, member.b_limit):
+                    member.a_limit = data.a_limit
+                    member.b_limit = data.b_limit
+                    print(f"App {member.client.target_id} 强度上限更新: A通道={data.a_limit}, B通道={data.b_limit}")
+            elif data == RetCode.CLIENT_DISCONNECTED:
+                print(f"App {member.client.target_id} 已断开连接，尝试重新绑定...")
+                await member.client.rebind()
+                member._msg_prefix = None
+                print(f"已与 App {member.client.target_id} 重新绑定")
+
+
+async def main(member_count):
+    """广播示例：等待多个 App 绑定，然后循环向所有 App 发送配置中的波形"""
+    group = BroadcastGroup()
+    uri = f'ws://{get_host_ip()}:5678'
+    connects = []
+    try:
+        for index in range(member_count):
+            connect = DGLabWSConnect(uri, CONNECTION_TIMEOUT)
+            client = await connect.__aenter__()
+            connects.append(connect)
+            print(f"请用第 {index + 1} 台 DG-Lab App 扫描二维码以连接")
+            print_qrcode(client.get_qrcode(), index if member_count > 1 else None, show_image=member_count == 1)
+            await client.bind()
+            print(f"已与 App {client.target_id} 成功绑定")
+            group.members.append(BroadcastMember(client))
+
+        watch_tasks = [asyncio.create_task(group.watch_member(member)) for member in group.members]
+        try:
+            await group.set_strength(Channel.A, 1)
+            await group.set_strength(Channel.B, 1)
+            while True:
+                await group.add_pulses(Channel.A, PULSE_DATA[CURRENT_WAVEFORM_A])
+                await group.add_pulses(Channel.B, PULSE_DATA[CURRENT_WAVEFORM_B])
+                await asyncio.sleep(WAVEFORM_SEND_INTERVAL * 0.1)
+        finally:
+            for task in watch_tasks:
+                task.cancel()
+    finally:
+        for connect in connects:
+            await connect.__aexit__(None, None, None)
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 2))
+    except KeyboardInterrupt:
+        print("\n程序被用户中断")
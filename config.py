@@ -4,6 +4,14 @@ CURRENT_WAVEFORM_B = "呼吸"  # B通道当前使用的波形
 WAVEFORM_SEND_INTERVAL = 12   # 波形发送间隔（检测次数）
 
 CONNECTION_TIMEOUT = 30                   # 连接超时时间（秒）
+CONTROL_API_PORT = None                   # 本地控制接口端口，设置为端口号（如 5679）时启用，供游戏直接控制
+HEADLESS_MODE = False                     # 无界面模式：只在终端打印二维码，不保存PNG也不打开图片
+HOST_IP = None                            # 二维码中使用的本机IP，为 None 时自动检测；多网卡自动检测不对时手动填写，如 "192.168.1.10"
+
+# 波形筛选条件：切换波形时只在符合条件的波形间切换，为空时不筛选
+# 可用特征：duration(时长秒) mean(平均强度) peak(最大强度) freq_min/freq_max(频率范围) energy(能量)
+# 例如 {"peak": (None, 60), "duration": (5, 10)} 表示最大强度不超过60、时长5~10秒
+WAVEFORM_FILTER = {}
 
 # 波形数据 - 所有可用的波形
 PULSE_DATA = {
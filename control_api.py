@@ -0,0 +1,198 @@
+import asyncio
+import json
+
+from websockets import ConnectionClosed
+from websockets.server import serve as ws_serve
+from pydglab_ws import Channel
+from pydglab_ws.utils import PULSE_DATA_MAX_LENGTH
+
+# 本地控制接口：游戏通过本机 WebSocket 发送 JSON 指令（单条或列表），例如
+#   {"cmd": "strength", "channel": "A", "value": 10}       设置强度
+#   {"cmd": "strength", "channel": "B", "delta": -2}       调整强度
+#   {"cmd": "waveform", "channel": "A", "name": "呼吸"}    按名称切换波形
+#   {"cmd": "pulses", "channel": "A", "frames": [[[10,10,10,10],[0,50,100,50]]]}  追加临时波形
+# 可选字段 "session" 指定会话序号，默认为 0
+# 同一时刻到达的多条指令会合并：强度只发送最终值，波形只切换到最后一个
+# 每帧为 [4个频率(10~240), 4个强度(0~100)]
+
+CONTROL_API_HOST = "127.0.0.1"
+PULSE_FREQUENCY_RANGE = (10, 240)
+PULSE_INTENSITY_RANGE = (0, 100)
+
+
+class ControlCommandError(ValueError):
+    """控制指令格式错误"""
+
+
+class ControlAPI:
+    """本地控制接口，指令直接作用于会话的通道，不经过 App 按钮"""
+
+    def __init__(self, sessions):
+        self.sessions = sessions
+        # (会话序号, 通道) -> 待处理的内容
+        self._pending_strength = {}   # -> [设置值或None, 调整量]
+        self._pending_waveform = {}   # -> 波形名称
+        self._pending_pulses = {}     # -> 帧列表
+        self._flush_task = None
+        # (会话序号, 通道) -> 正在进行的波形切换，切换在单独的任务中进行，不阻塞其他指令
+        self._switch_tasks = {}
+
+    def _parse_target(self, command):
+        session_index = command.get("session", 0)
+        if not isinstance(session_index, int) or not 0 <= session_index < len(self.sessions):
+            raise ControlCommandError(f"会话不存在: {session_index}")
+        try:
+            channel = Channel[command["channel"]]
+        except KeyError:
+            raise ControlCommandError(f"通道错误: {command.get('channel')}")
+        return session_index, channel
+
+    @staticmethod
+    def _parse_frames(frames):
+        """检查临时波形的每一帧：4个频率与4个强度，均在协议允许的范围内"""
+        if not isinstance(frames, list):
+            raise ControlCommandError("frames 必须是列表")
+        parsed = []
+        for frame in frames:
+            try:
+                frequency, intensity = (tuple(map(int, values)) for values in frame)
+            except (TypeError, ValueError):
+                raise ControlCommandError(f"帧格式错误: {frame}")
+            for values, (low, high) in ((frequency, PULSE_FREQUENCY_RANGE), (intensity, PULSE_INTENSITY_RANGE)):
+                if len(values) != 4 or not all(low <= value <= high for value in values):
+                    raise ControlCommandError(f"帧数据错误，需要4个{low}~{high}的值: {list(values)}")
+            parsed.append((frequency, intensity))
+        return parsed
+
+    def submit(self, command):
+        """登记一条指令，合并到待处理内容中"""
+        if not isinstance(command, dict):
+            raise ControlCommandError(f"指令必须是对象: {command}")
+        key = self._parse_target(command)
+        cmd = command.get("cmd")
+
+        if cmd == "strength":
+            pending = self._pending_strength.setdefault(key, [None, 0])
+            if "value" in command:
+                pending[0] = int(command["value"])
+                pending[1] = 0
+            else:
+                pending[1] += int(command.get("delta", 0))
+
+        elif cmd == "waveform":
+            name = command.get("name")
+            if name not in self.sessions[key[0]].library:
+                raise ControlCommandError(f"波形不存在: {name}")
+            self._pending_waveform[key] = name
+
+        elif cmd == "pulses":
+            if "frames" not in command:
+                raise ControlCommandError("缺少 frames")
+            frames = self._parse_frames(command["frames"])
+            self._pending_pulses.setdefault(key, []).extend(frames)
+
+        else:
+            raise ControlCommandError(f"未知指令: {cmd}")
+
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush())
+
+    async def _flush(self):
+        # 让出一次事件循环，同一时刻到达的指令一起处理
+        await asyncio.sleep(0)
+        # 处理过程中到达的指令会进入新的待处理内容，循环直到全部处理完
+        while self._pending_strength or self._pending_waveform or self._pending_pulses:
+            await self._dispatch()
+
+    async def _dispatch(self):
+        pending_strength, self._pending_strength = self._pending_strength, {}
+        pending_waveform, self._pending_waveform = self._pending_waveform, {}
+        pending_pulses, self._pending_pulses = self._pending_pulses, {}
+
+        for (session_index, channel), (value, delta) in pending_strength.items():
+            session = self.sessions[session_index]
+            bound = session.client is not None and not session.client.not_bind
+            simple_control = session.simple_control
+            current = simple_control.current_strength_a if channel == Channel.A else simple_control.current_strength_b
+            strength = max(1, (current if value is None else value) + delta)
+            if channel == Channel.A:
+                simple_control.current_strength_a = strength
+            else:
+                simple_control.current_strength_b = strength
+            # 立即下发，不等待控制循环的下一次检测；未绑定时由控制循环在绑定后下发
+            if not bound:
+                continue
+            output_strength_a, output_strength_b = simple_control.get_output_strength()
+            await session.set_strength(
+                channel,
+                output_strength_a if channel == Channel.A else output_strength_b,
+                immediate=True
+            )
+
+        # 波形切换放到单独的任务中，切换时的等待不影响之后的强度与临时波形；
+        # 同一通道同时有临时波形时由切换任务在清除队列后发送，避免被清除
+        for key, name in pending_waveform.items():
+            session_index, channel = key
+            session = self.sessions[session_index]
+            index = session.library.index_of(name)
+            if channel == Channel.A:
+                session.current_waveform_index_a = index
+            else:
+                session.current_waveform_index_b = index
+            frames = pending_pulses.pop(key, None)
+            if session.client is None or session.client.not_bind:
+                continue
+            if (running := self._switch_tasks.get(key)) and not running.done():
+                running.cancel()
+            self._switch_tasks[key] = asyncio.create_task(self._switch_waveform(session, channel, frames))
+
+        for (session_index, channel), frames in pending_pulses.items():
+            session = self.sessions[session_index]
+            if session.client is None or session.client.not_bind:
+                continue
+            await self._send_pulses(session, channel, frames)
+
+    @staticmethod
+    async def _send_pulses(session, channel, frames):
+        from demo import console
+        try:
+            for i in range(0, len(frames), PULSE_DATA_MAX_LENGTH):
+                await session.add_pulses(channel, *frames[i:i + PULSE_DATA_MAX_LENGTH])
+        except Exception as e:
+            console.log(f"控制接口发送波形出错: {e}")
+
+    async def _switch_waveform(self, session, channel, frames=None):
+        """切换波形；有临时波形时清除队列一次，先发送临时波形，再接上新的波形"""
+        if not frames:
+            await session.send_waveform(channel)
+            return
+        try:
+            await session.clear_pulses(channel)
+            await session.sleep(0.1)
+        except Exception as e:
+            pass  # 忽略清除波形错误
+        await self._send_pulses(session, channel, frames)
+        await session.send_waveform(channel, clear_first=False)
+
+    async def _handler(self, websocket):
+        try:
+            async for message in websocket:
+                try:
+                    commands = json.loads(message)
+                    for command in commands if isinstance(commands, list) else (commands,):
+                        self.submit(command)
+                except (ValueError, TypeError) as e:
+                    await websocket.send(json.dumps({"error": str(e)}, ensure_ascii=False))
+        except ConnectionClosed:
+            pass
+
+    async def serve(self, port):
+        """在本机端口上运行控制接口，直到任务被取消"""
+        from demo import console
+        async with ws_serve(self._handler, CONTROL_API_HOST, port, compression=None):
+            console.log(f"本地控制接口已启动: ws://{CONTROL_API_HOST}:{port}")
+            try:
+                await asyncio.Future()
+            finally:
+                for task in self._switch_tasks.values():
+                    task.cancel()
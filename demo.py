@@ -1,12 +1,15 @@
 import asyncio
 import io
-import qrcode
+from bisect import bisect_left, bisect_right
+from collections import deque
+import ipaddress
 import time
 import socket
 import os
 import sys
 from websockets import ConnectionClosedOK
 from pydglab_ws import DGLabWSConnect, StrengthData, FeedbackButton, Channel, StrengthOperationType, RetCode
+from pydglab_ws.utils import PULSE_DATA_MAX_LENGTH
 
 # 导入配置文件
 if getattr(sys, 'frozen', False):
@@ -20,65 +23,189 @@ from config import (
     CURRENT_WAVEFORM_A,
     CURRENT_WAVEFORM_B,
     WAVEFORM_SEND_INTERVAL,
-    CONNECTION_TIMEOUT
+    CONNECTION_TIMEOUT,
+    CONTROL_API_PORT,
+    HEADLESS_MODE,
+    HOST_IP,
+    WAVEFORM_FILTER
 )
+from recorder import SessionRecorder, RecordingClient
+from control_api import ControlAPI
+from waveform_catalog import WaveformCatalog
+from status_logger import StatusLogger
 
-# 全局变量
-client = None
-control_task = None
+# 频繁的状态输出交给后台线程限速打印，避免阻塞事件循环
+console = StatusLogger()
 
-# 波形列表
-available_waveforms = list(PULSE_DATA.keys())
+# 强度指令合并窗口（秒），窗口内的多次变化只发送一次
+STRENGTH_WRITE_WINDOW = 0.03
 
-# 根据config中的波形名称设置初始索引
-try:
-    current_waveform_index_a = available_waveforms.index(CURRENT_WAVEFORM_A)
-except ValueError:
-    current_waveform_index_a = 0  # 如果波形不存在，使用第一个
+# App 每个通道的波形队列最多缓存的时长（秒），即500帧，超出的部分被 App 丢弃
+APP_QUEUE_SECONDS = 50
 
-try:
-    current_waveform_index_b = available_waveforms.index(CURRENT_WAVEFORM_B)
-except ValueError:
-    current_waveform_index_b = 0  # 如果波形不存在，使用第一个
 
-# 记录每个通道上一次发送的波形名称
-last_waveform_name_a = None
-last_waveform_name_b = None
+class WaveformLibrary:
+    """只读波形库，预先分好块并计算特征目录，所有会话共享同一份"""
 
-# SimpleControl实例
-simple_control = None
+    def __init__(self, pulse_data):
+        # 波形列表
+        self.names = tuple(pulse_data.keys())
+        self.frames = {}
+        self.chunks = {}
+        for name, frames in pulse_data.items():
+            # 如果波形太长，截断到安全长度
+            self.frames[name] = tuple(frames[:500])
+            self.chunks[name] = self.chunks_from(name)
+        self.catalog = WaveformCatalog(self.frames)
+        # 筛选条件 -> 符合条件的波形索引（升序），每个条件只查询一次
+        self._candidates = {}
 
-# 记录上一次的强度值，用于避免重复打印
-last_strength_a = 1
-last_strength_b = 1
+    def __contains__(self, name):
+        return name in self.chunks
 
-# 记录上一次的手机上限，用于避免重复打印
-last_a_limit = None
-last_b_limit = None
+    def __len__(self):
+        return len(self.names)
 
+    def index_of(self, name):
+        """根据波形名称获取索引，如果波形不存在，使用第一个"""
+        try:
+            return self.names.index(name)
+        except ValueError:
+            return 0
+
+    def name_at(self, index):
+        return self.names[index % len(self.names)]
+
+    def step_index(self, index, step, waveform_filter=None):
+        """
+        从当前索引向前（step=1）或向后（step=-1）切换到下一个符合筛选条件的波形
+
+        :param waveform_filter: 特征筛选条件，见 :meth:`WaveformCatalog.query`，没有符合条件的波形时不筛选
+        """
+        candidates = self.filter_indexes(waveform_filter) if waveform_filter else None
+        if not candidates:
+            return (index + step) % len(self.names)
+        if step > 0:
+            position = bisect_right(candidates, index)
+            return candidates[position] if position < len(candidates) else candidates[0]
+        position = bisect_left(candidates, index)
+        return candidates[position - 1] if position > 0 else candidates[-1]
+
+    def filter_indexes(self, waveform_filter):
+        """符合筛选条件的波形索引，按升序排列，结果按条件缓存"""
+        key = tuple(sorted((feature, tuple(bounds)) for feature, bounds in waveform_filter.items()))
+        if key not in self._candidates:
+            matched = set(self.catalog.query(**waveform_filter))
+            self._candidates[key] = [i for i, name in enumerate(self.names) if name in matched]
+        return self._candidates[key]
+
+    def chunks_from(self, name, offset=0):
+        """从指定帧开始分块，用于断线后从中断位置继续播放"""
+        frames = self.frames[name][offset:]
+        return tuple(frames[i:i + PULSE_DATA_MAX_LENGTH] for i in range(0, len(frames), PULSE_DATA_MAX_LENGTH))
+
+
+waveform_library = WaveformLibrary(PULSE_DATA)
+available_waveforms = list(waveform_library.names)
+
+
+def _list_interface_ips():
+    """枚举本机网卡的IPv4地址，不需要网络连接"""
+    ips = []
+    try:
+        for info in socket.getaddrinfo(socket.gethostname(), None, socket.AF_INET):
+            ips.append(info[4][0])
+    except OSError:
+        pass
 
-def get_host_ip():
-    """获取本机IP地址"""
+    # Linux下主机名通常只解析到回环地址，逐个网卡查询
+    try:
+        import fcntl
+        import struct
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as ss:
+            for _, name in socket.if_nameindex():
+                try:
+                    # SIOCGIFADDR
+                    packed = fcntl.ioctl(ss.fileno(), 0x8915, struct.pack('256s', name.encode()[:15]))
+                    ips.append(socket.inet_ntoa(packed[20:24]))
+                except OSError:
+                    pass
+    except (ImportError, AttributeError, OSError):
+        pass
+    return ips
+
+
+def _route_ip():
+    """默认路由对应的本机地址（UDP不会真正发送数据），没有默认路由时返回 None"""
     ss = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
     try:
         ss.connect(('8.8.8.8', 80))
-        ip = ss.getsockname()[0]
+        return ss.getsockname()[0]
+    except OSError:
+        return None
     finally:
         ss.close()
-    return ip
 
 
-def print_qrcode(data: str):
-    """生成并显示二维码"""
-    try:
-        qr_ascii = qrcode.QRCode()
-        qr_ascii.add_data(data)
-        f = io.StringIO()
-        qr_ascii.print_ascii(out=f)
-        f.seek(0)
-        print("请用 DG-Lab App 扫描以下二维码:")
-        print(f.read())
+def get_host_ip():
+    """
+    获取本机IP地址
+
+    优先使用配置中的 ``HOST_IP``，其次使用默认路由对应的地址（多网卡时与局域网出口一致），
+    离线时枚举网卡地址，优先局域网地址，都没有时退回本机回环地址
+    """
+    global _host_ip
+    if _host_ip is not None:
+        return _host_ip
+
+    if HOST_IP:
+        _host_ip = HOST_IP
+    elif route_ip := _route_ip():
+        _host_ip = route_ip
+    else:
+        candidates = []
+        for ip in _list_interface_ips():
+            address = ipaddress.ip_address(ip)
+            if not (address.is_loopback or address.is_link_local) and ip not in candidates:
+                candidates.append(ip)
+        # 局域网地址排在前面，App 一般与电脑在同一局域网
+        candidates.sort(key=lambda ip: not ipaddress.ip_address(ip).is_private)
+        _host_ip = candidates[0] if candidates else '127.0.0.1'
+        if len(candidates) > 1:
+            console.log(f"检测到多个本机地址: {', '.join(candidates)}，使用 {_host_ip}，不正确时请在配置中设置 HOST_IP")
+    return _host_ip
+
+
+_host_ip = None
+
+
+def _render_qrcode_ascii(data: str):
+    """生成文本二维码，二维码库（会连带导入PIL）推迟到第一次打印二维码时才导入，回放等用法不需要加载"""
+    import qrcode
+    qr_ascii = qrcode.QRCode()
+    qr_ascii.add_data(data)
+    f = io.StringIO()
+    qr_ascii.print_ascii(out=f)
+    return f.getvalue()
+
+
+def print_qrcode(data: str, index=None, show_image=True):
+    """
+    生成并显示二维码，无界面模式下只在终端打印
+
+    :param index: 会话序号，多个会话时标注在二维码旁，PNG文件按序号命名
+    :param show_image: 是否打开图片查看器，多个会话同时等待扫码时不打开
+    """
+    label = "" if index is None else f"（会话 {index}）"
+    console.log(f"请用 DG-Lab App 扫描以下二维码{label}:")
+    console.log(_render_qrcode_ascii(data))
+
+    if HEADLESS_MODE:
+        console.log(f"二维码内容: {data}")
+        return
 
+    try:
+        import qrcode
         qr_png = qrcode.QRCode(
             version=1,
             error_correction=qrcode.constants.ERROR_CORRECT_L,
@@ -89,27 +216,23 @@ def print_qrcode(data: str):
         qr_png.make(fit=True)
 
         img = qr_png.make_image(fill_color="black", back_color="white")
-        qr_code_path = os.path.join(base_dir, "dg_lab_qrcode.png")
+        file_name = "dg_lab_qrcode.png" if index is None else f"dg_lab_qrcode_{index}.png"
+        qr_code_path = os.path.join(base_dir, file_name)
         img.save(qr_code_path)
-        img.show()
+        if show_image:
+            img.show()
 
-        print(f"二维码PNG文件已保存为: {qr_code_path}")
+        console.log(f"二维码PNG文件已保存为: {qr_code_path}")
 
     except Exception as e:
-        print(f"生成二维码时出错: {e}")
-        qr = qrcode.QRCode()
-        qr.add_data(data)
-        f = io.StringIO()
-        qr.print_ascii(out=f)
-        f.seek(0)
-        print("请用 DG-Lab App 扫描以下二维码:")
-        print(f.read())
+        console.log(f"生成二维码时出错: {e}")
 
 
 class SimpleControl:
     """简化控制类"""
 
-    def __init__(self):
+    def __init__(self, session=None):
+        self.session = session
         self.current_strength_a = 1
         self.current_strength_b = 1
         self.a_limit = 999  # 初始值，将从手机获取
@@ -118,27 +241,29 @@ class SimpleControl:
         self.protect_active = False
         self.output_active = True
 
+        # 记录上一次的手机上限，用于避免重复打印
+        self.last_a_limit = None
+        self.last_b_limit = None
+
     def update_limits(self, a_limit, b_limit):
         """更新手机强度上限，只有变化时才打印"""
-        global last_a_limit, last_b_limit
-
         # 检查是否有变化
         changed = False
-        if a_limit != last_a_limit:
+        if a_limit != self.last_a_limit:
             changed = True
-        if b_limit != last_b_limit:
+        if b_limit != self.last_b_limit:
             changed = True
 
         # 如果发生变化，则更新并打印
         if changed:
             self.a_limit = a_limit
             self.b_limit = b_limit
-            print(f"手机强度上限更新: A通道={a_limit}, B通道={b_limit}")
+            console.log(f"手机强度上限更新: A通道={a_limit}, B通道={b_limit}")
             self.print_status()
 
             # 更新记录的上一次值
-            last_a_limit = a_limit
-            last_b_limit = b_limit
+            self.last_a_limit = a_limit
+            self.last_b_limit = b_limit
 
     def get_output_strength(self):
         """获取当前应该输出的强度，确保不超过手机上限"""
@@ -152,154 +277,486 @@ class SimpleControl:
         return output_a, output_b
 
     def print_status(self):
-        """打印当前状态信息"""
-        global current_waveform_index_a, current_waveform_index_b
-        print("=" * 30)
-        print("|当前状态信息:")
-        print(f"|A通道波形: {available_waveforms[current_waveform_index_a % len(available_waveforms)]}")
-        print(f"|B通道波形: {available_waveforms[current_waveform_index_b % len(available_waveforms)]}")
-        print(f"|A通道强度: {self.current_strength_a}/{self.a_limit}")
-        print(f"|B通道强度: {self.current_strength_b}/{self.b_limit}")
-        print("=" * 30)
+        """打印当前状态信息（限速，短时间内多次调用只打印最新的一次）"""
+        lines = ["=" * 30, "|当前状态信息:"]
+        if self.session is not None:
+            lines.append(f"|A通道波形: {self.session.get_waveform_name(Channel.A)}")
+            lines.append(f"|B通道波形: {self.session.get_waveform_name(Channel.B)}")
+        lines.append(f"|A通道强度: {self.current_strength_a}/{self.a_limit}")
+        lines.append(f"|B通道强度: {self.current_strength_b}/{self.b_limit}")
+        lines.append("=" * 30)
+        console.status("\n".join(lines))
+
+
+class StrengthWriter:
+    """
+    强度指令合并发送
+
+    短时间内的多次强度变化合并为每个通道一条指令；强度未变化时不发送；
+    App 已确认上一次发送的强度时，增减指令比直接设置更短则使用增减，否则直接设置（重复发送也不会出错）
+    """
+
+    def __init__(self, session):
+        self.session = session
+        self.pending = {}    # 通道 -> 待发送的强度
+        self.sent = {}       # 通道 -> 上一次发送的强度
+        self.reported = {}   # 通道 -> App 上报的强度
+        self._flush_task = None
+
+    def update_app_strength(self, a, b):
+        """根据 App 上报的强度数据更新"""
+        self.reported[Channel.A] = a
+        self.reported[Channel.B] = b
+
+    def reset(self):
+        """App 重新绑定后强度未知，清除记录"""
+        self.sent.clear()
+        self.reported.clear()
+
+    def request(self, channel, strength):
+        """登记强度变化，合并窗口结束后发送"""
+        self.pending[channel] = strength
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        # 使用会话的等待，回放时合并窗口按虚拟时钟计算
+        await self.session.sleep(STRENGTH_WRITE_WINDOW)
+        await self.flush()
+
+    @staticmethod
+    def choose_operation(current, target):
+        """选择指令更短的强度变化模式，``current`` 为 ``None`` 时直接设置"""
+        if current is not None:
+            delta = target - current
+            if len(str(abs(delta))) < len(str(target)):
+                if delta > 0:
+                    return StrengthOperationType.INCREASE, delta
+                return StrengthOperationType.DECREASE, -delta
+        return StrengthOperationType.SET_TO, target
+
+    async def flush(self):
+        """立即发送所有待发送的强度"""
+        client = self.session.client
+        if client is None or client.not_bind:
+            return  # 未绑定时保留，绑定后由控制循环再次登记
+        # 发送过程中登记的强度进入新的待发送内容，循环直到全部发出
+        while self.pending:
+            pending, self.pending = self.pending, {}
+            for channel, target in pending.items():
+                sent = self.sent.get(channel)
+                reported = self.reported.get(channel)
+                confirmed = sent is not None and reported == sent
+                # 已发送且 App 没有报告不同的强度，无需重复发送
+                if target == sent and (reported is None or confirmed):
+                    continue
+                operation_type, value = self.choose_operation(sent if confirmed else None, target)
+                await client.set_strength(channel, operation_type, value)
+                self.sent[channel] = target
+
+
+class PulseQueue:
+    """
+    模拟 App 中一个通道的波形队列，用于估算当前正在播放波形的第几帧
+
+    队列按添加顺序播放，每帧100ms，播放完后空闲；超过 App 缓存上限的帧被丢弃
+    """
+
+    def __init__(self, session):
+        self.session = session
+        self.segments = deque()   # (开始播放时间, 对应波形的起始帧或None, 帧数)
+        self.queued_until = 0.0   # 队列中已有的帧播放完的时间
+
+    def clear(self):
+        self.segments.clear()
+        self.queued_until = self.session.clock()
+
+    def add(self, count, offset=None):
+        """
+        记录添加到队列的帧
+
+        :param offset: 这些帧从当前波形的第几帧开始，临时波形为 ``None``
+        """
+        now = self.session.clock()
+        start = max(now, self.queued_until)
+        count = min(count, round((now + APP_QUEUE_SECONDS - start) / 0.1))
+        if count <= 0:
+            return
+        self.segments.append((start, offset, count))
+        self.queued_until = start + count * 0.1
+
+    def playing_offset(self):
+        """当前正在播放当前波形的第几帧，队列空闲或正在播放临时波形时为0"""
+        now = self.session.clock()
+        while self.segments and self.segments[0][0] + self.segments[0][2] * 0.1 <= now:
+            self.segments.popleft()
+        if not self.segments:
+            return 0
+        start, offset, _ = self.segments[0]
+        if offset is None or start > now:
+            return 0
+        return offset + int((now - start) / 0.1)
+
+
+class DemoSession:
+    """一个 App 的控制会话，持有自己的连接、SimpleControl 与通道状态"""
+
+    def __init__(self, library=waveform_library, recorder=None, index=None):
+        self.library = library
+        self.recorder = recorder
+        # 会话序号，只在多个会话时设置，用于区分二维码
+        self.index = index
+
+        # 会话使用的时钟与等待，回放时替换为虚拟时钟
+        self.clock = time.monotonic
+        self.sleep = asyncio.sleep
+        self.client = None
+        self.control_task = None
+        self.simple_control = SimpleControl(self)
+        self.strength_writer = StrengthWriter(self)
+
+        # 根据config中的波形名称设置初始索引
+        self.current_waveform_index_a = library.index_of(CURRENT_WAVEFORM_A)
+        self.current_waveform_index_b = library.index_of(CURRENT_WAVEFORM_B)
+
+        # 波形特征筛选条件，切换波形时只在符合条件的波形间切换
+        self.waveform_filter = WAVEFORM_FILTER
+
+        # 记录每个通道上一次发送的波形名称
+        self.last_waveform_name_a = None
+        self.last_waveform_name_b = None
+
+        # 记录上一次的强度值，用于避免重复打印
+        self.last_strength_a = 1
+        self.last_strength_b = 1
+
+        # 模拟 App 的波形队列，用于计算断开时的播放位置
+        self.pulse_queues = {Channel.A: PulseQueue(self), Channel.B: PulseQueue(self)}
+
+    def get_waveform_name(self, channel):
+        """获取通道当前选择的波形名称"""
+        if channel == Channel.A:
+            return self.library.name_at(self.current_waveform_index_a)
+        return self.library.name_at(self.current_waveform_index_b)
+
+    async def step_waveform(self, channel, step):
+        """切换到下一个（step=1）或上一个（step=-1）符合筛选条件的波形并发送"""
+        if channel == Channel.A:
+            self.current_waveform_index_a = self.library.step_index(self.current_waveform_index_a, step, self.waveform_filter)
+        else:
+            self.current_waveform_index_b = self.library.step_index(self.current_waveform_index_b, step, self.waveform_filter)
+        direction = "下" if step > 0 else "上"
+        console.log(f"{channel.name}通道切换到{direction}一个波形: {self.get_waveform_name(channel)}")
+        await self.send_waveform(channel)
+
+    def get_playback_offset(self, channel):
+        """通道当前播放到当前波形的第几帧，根据模拟的 App 波形队列计算"""
+        return self.pulse_queues[channel].playing_offset()
+
+    async def add_pulses(self, channel, *pulses, offset=None):
+        """
+        向 App 添加波形并记录到模拟队列
+
+        :param offset: 这些帧从当前波形的第几帧开始，临时波形为 ``None``
+        """
+        await self.client.add_pulses(channel, *pulses)
+        self.pulse_queues[channel].add(len(pulses), offset)
+
+    async def clear_pulses(self, channel):
+        await self.client.clear_pulses(channel)
+        self.pulse_queues[channel].clear()
+
+    async def send_waveform(self, channel, waveform_name=None, clear_first=True, print_info=True):
+        """发送波形到指定通道"""
+        try:
+            if self.client is None:
+                return False
 
+            if waveform_name is None:
+                waveform_name = self.get_waveform_name(channel)
 
-async def send_waveform(channel, waveform_name=None, clear_first=True, print_info=True):
-    """发送波形到指定通道"""
-    global last_waveform_name_a, last_waveform_name_b
+            if waveform_name in self.library:
+                # 检查波形是否发生变化，只有变化时才打印
+                should_print = False
+                if channel == Channel.A:
+                    if self.last_waveform_name_a != waveform_name:
+                        self.last_waveform_name_a = waveform_name
+                        should_print = True
+                else:
+                    if self.last_waveform_name_b != waveform_name:
+                        self.last_waveform_name_b = waveform_name
+                        should_print = True
+
+                # 只有在波形发生变化且需要打印信息时才打印
+                if print_info and should_print:
+                    console.log(f"发送波形到{channel.name}通道: {waveform_name}")
+                    self.simple_control.print_status()
+
+                # 清除旧波形
+                if clear_first:
+                    try:
+                        await self.clear_pulses(channel)
+                        await self.sleep(0.1)
+                    except Exception as e:
+                        pass  # 忽略清除波形错误
+
+                # 分块发送（分块在波形库中已预先完成）
+                offset = 0
+                for chunk in self.library.chunks[waveform_name]:
+                    await self.add_pulses(channel, *chunk, offset=offset)
+                    offset += len(chunk)
+                    await self.sleep(0.05)
+
+                return True
+            else:
+                return False
+        except Exception as e:
+            return False  # 忽略发送波形错误
 
-    try:
-        if client is None:
-            return False
+    async def set_strength(self, channel, strength, immediate=False):
+        """
+        设置指定通道的强度，确保不超过手机上限
 
-        if waveform_name is None:
-            if channel == Channel.A:
-                waveform_name = available_waveforms[current_waveform_index_a % len(available_waveforms)]
-            else:
-                waveform_name = available_waveforms[current_waveform_index_b % len(available_waveforms)]
-
-        if waveform_name in PULSE_DATA:
-            # 检查波形是否发生变化，只有变化时才打印
-            should_print = False
-            if channel == Channel.A:
-                if last_waveform_name_a != waveform_name:
-                    last_waveform_name_a = waveform_name
+        强度先交给 StrengthWriter 合并，``immediate`` 为真时立即发送
+        """
+        try:
+            if self.client:
+                # 获取当前通道的上限
+                limit = self.simple_control.a_limit if channel == Channel.A else self.simple_control.b_limit
+
+                # 检查强度是否超过上限
+                if strength > limit:
+                    console.log(f"警告: {channel.name}通道强度{strength}超过手机上限{limit}，设置为上限值{limit}")
+                    strength = limit
+
+                # 确保强度不低于1
+                strength = max(1, strength)
+
+                # 检查强度是否变化，变化时才打印
+                should_print = False
+                if channel == Channel.A and self.last_strength_a != strength:
+                    self.last_strength_a = strength
                     should_print = True
-            else:
-                if last_waveform_name_b != waveform_name:
-                    last_waveform_name_b = waveform_name
+                elif channel == Channel.B and self.last_strength_b != strength:
+                    self.last_strength_b = strength
                     should_print = True
 
-            # 只有在波形发生变化且需要打印信息时才打印
-            if print_info and should_print:
-                if channel == Channel.A:
-                    print(f"发送波形到A通道: {waveform_name}")
-                    simple_control.print_status()
-                else:
-                    print(f"发送波形到B通道: {waveform_name}")
-                    simple_control.print_status()
+                if should_print:
+                    console.log(f"设置{channel.name}通道强度: {strength}/{limit}")
+                    self.simple_control.print_status()
 
-            # 清除旧波形
-            if clear_first:
-                try:
-                    await client.clear_pulses(channel)
-                    await asyncio.sleep(0.1)
-                except Exception as e:
-                    pass  # 忽略清除波形错误
+                self.strength_writer.request(channel, strength)
+                if immediate:
+                    await self.strength_writer.flush()
+        except Exception as e:
+            pass  # 忽略设置强度错误
 
-            pulse_data = PULSE_DATA[waveform_name]
+    async def control_loop(self):
+        """主控制循环"""
+        waveform_counter = 0
 
-            # 如果波形太长，截断到安全长度
-            if len(pulse_data) > 500:
-                pulse_data = pulse_data[:500]
+        try:
+            while True:
+                # 等待重新绑定期间不发送，避免与重新绑定争抢连接
+                if self.client.not_bind:
+                    await self.sleep(0.1)
+                    continue
 
-            # 分块发送
-            chunk_size = 100
-            for i in range(0, len(pulse_data), chunk_size):
-                chunk = pulse_data[i:i + chunk_size]
-                await client.add_pulses(channel, *chunk)
-                await asyncio.sleep(0.05)
+                # 获取当前输出强度（这里会确保不超过上限）
+                output_strength_a, output_strength_b = self.simple_control.get_output_strength()
 
-            return True
-        else:
-            return False
-    except Exception as e:
-        return False  # 忽略发送波形错误
+                # 分别设置A、B通道强度
+                await self.set_strength(Channel.A, output_strength_a)
+                await self.set_strength(Channel.B, output_strength_b)
 
+                # 定期发送波形
+                if waveform_counter % WAVEFORM_SEND_INTERVAL == 0:
+                    # 发送波形到两个通道，但不打印信息
+                    await self.send_waveform(Channel.A, clear_first=False, print_info=False)
+                    await self.send_waveform(Channel.B, clear_first=False, print_info=False)
 
-async def set_strength(channel, strength):
-    """设置指定通道的强度，确保不超过手机上限"""
-    global last_strength_a, last_strength_b
+                waveform_counter += 1
+                await self.sleep(0.1)
 
-    try:
-        if client and simple_control:
-            # 获取当前通道的上限
-            limit = simple_control.a_limit if channel == Channel.A else simple_control.b_limit
-
-            # 检查强度是否超过上限
-            if strength > limit:
-                print(f"警告: {channel.name}通道强度{strength}超过手机上限{limit}，设置为上限值{limit}")
-                strength = limit
-
-            # 确保强度不低于1
-            strength = max(1, strength)
-
-            # 检查强度是否变化，变化时才打印
-            should_print = False
-            if channel == Channel.A and last_strength_a != strength:
-                last_strength_a = strength
-                should_print = True
-            elif channel == Channel.B and last_strength_b != strength:
-                last_strength_b = strength
-                should_print = True
-
-            if should_print:
-                print(f"设置{channel.name}通道强度: {strength}/{limit}")
-                simple_control.print_status()
-
-            await client.set_strength(
-                channel,
-                StrengthOperationType.SET_TO,
-                strength
-            )
-    except Exception as e:
-        pass  # 忽略设置强度错误
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            pass  # 忽略控制循环错误
+
+    async def handle_data(self, data):
+        """处理一条来自 App 的消息"""
+        simple_control = self.simple_control
+
+        # 接收通道强度数据（获取手机上限）
+        if isinstance(data, StrengthData):
+            # 直接从手机数据获取上限，更新控制实例中的上限（只有变化时才打印）
+            simple_control.update_limits(data.a_limit, data.b_limit)
+            self.strength_writer.update_app_strength(data.a, data.b)
+
+        # 接收 App 反馈按钮
+        elif isinstance(data, FeedbackButton):
+            console.log(f"按钮: {data.name}")
+
+            if data == FeedbackButton.A1:
+                # A1按钮：切换到下一个波形
+                await self.step_waveform(Channel.A, 1)
+
+            elif data == FeedbackButton.A2:
+                # A2按钮：A通道强度+1，由set_strength函数处理上限
+                simple_control.current_strength_a += 1
+                await self.set_strength(Channel.A, simple_control.get_output_strength()[0])
+
+            elif data == FeedbackButton.A3:
+                # A3按钮：A通道强度-1，确保不低于1
+                simple_control.current_strength_a = max(simple_control.current_strength_a - 1, 1)
+                await self.set_strength(Channel.A, simple_control.get_output_strength()[0])
+
+            elif data == FeedbackButton.A4:
+                # A4按钮：切换到上一个波形
+                await self.step_waveform(Channel.A, -1)
+
+            elif data == FeedbackButton.B1:
+                # B1按钮：切换到下一个波形
+                await self.step_waveform(Channel.B, 1)
+
+            elif data == FeedbackButton.B2:
+                # B2按钮：B通道强度+1，由set_strength函数处理上限
+                simple_control.current_strength_b += 1
+                await self.set_strength(Channel.B, simple_control.get_output_strength()[1])
+
+            elif data == FeedbackButton.B3:
+                # B3按钮：B通道强度-1，确保不低于1
+                simple_control.current_strength_b = max(simple_control.current_strength_b - 1, 1)
+                await self.set_strength(Channel.B, simple_control.get_output_strength()[1])
+
+            elif data == FeedbackButton.B4:
+                # B4按钮：切换到上一个波形
+                await self.step_waveform(Channel.B, -1)
+
+        # 接收心跳/App断开通知
+        elif data == RetCode.CLIENT_DISCONNECTED:
+            console.log("App 已断开连接，尝试重新绑定...")
+            # 记录断开时两个通道的播放位置
+            offset_a = self.get_playback_offset(Channel.A)
+            offset_b = self.get_playback_offset(Channel.B)
+            await self.client.rebind()
+            console.log("重新绑定成功")
+
+            # 立即恢复强度与剩余波形，不等待下一次周期发送
+            await self.resume_output(offset_a, offset_b)
+
+            # 重新绑定后显示当前状态
+            simple_control.print_status()
+
+    async def resume_output(self, offset_a, offset_b):
+        """重新绑定后恢复输出：先下发当前强度，再从断开时的位置继续发送波形"""
+        # 新连接的 App 强度未知，不能使用增减指令
+        self.strength_writer.reset()
+        output_strength_a, output_strength_b = self.simple_control.get_output_strength()
+        await self.set_strength(Channel.A, output_strength_a)
+        await self.set_strength(Channel.B, output_strength_b, immediate=True)
 
+        try:
+            for channel, offset in ((Channel.A, offset_a), (Channel.B, offset_b)):
+                # 新连接的 App 波形队列为空
+                self.pulse_queues[channel].clear()
+                waveform_name = self.get_waveform_name(channel)
+                for chunk in self.library.chunks_from(waveform_name, offset):
+                    await self.add_pulses(channel, *chunk, offset=offset)
+                    offset += len(chunk)
+        except Exception as e:
+            pass  # 忽略恢复波形错误
 
-async def control_loop():
-    """主控制循环"""
-    global simple_control
+    async def run(self, uri):
+        """连接服务端、等待绑定并处理消息，直到连接关闭"""
+        async with DGLabWSConnect(uri, CONNECTION_TIMEOUT) as ws_client:
+            self.client = ws_client
+            if self.recorder:
+                # 录制所有发出的指令
+                self.client = RecordingClient(ws_client, self.recorder)
 
-    simple_control = SimpleControl()
-    waveform_counter = 0
+            # 获取二维码
+            url = self.client.get_qrcode()
+            console.log("请用 DG-Lab App 扫描二维码以连接")
+            print_qrcode(url, self.index, show_image=self.index is None)
 
-    try:
-        while True:
-            # 获取当前输出强度（这里会确保不超过上限）
-            output_strength_a, output_strength_b = simple_control.get_output_strength()
+            # 等待绑定
+            await self.client.bind()
+            console.log(f"已与 App {self.client.target_id} 成功绑定")
 
-            # 分别设置A、B通道强度
-            await set_strength(Channel.A, output_strength_a)
-            await set_strength(Channel.B, output_strength_b)
+            # 显示初始状态信息
+            self.simple_control.print_status()
 
-            # 定期发送波形
-            if waveform_counter % WAVEFORM_SEND_INTERVAL == 0:
-                # 发送波形到两个通道，但不打印信息
-                await send_waveform(Channel.A, clear_first=False, print_info=False)
-                await send_waveform(Channel.B, clear_first=False, print_info=False)
+            # 启动控制任务
+            self.control_task = asyncio.create_task(self.control_loop())
 
-            waveform_counter += 1
-            await asyncio.sleep(0.1)
+            try:
+                # 处理DG-Lab消息
+                async for data in self.client.data_generator():
+                    if self.recorder:
+                        self.recorder.record_inbound(data)
+                    await self.handle_data(data)
+            finally:
+                # 取消控制任务
+                self.control_task.cancel()
+                await self.control_task
 
-    except asyncio.CancelledError:
-        pass
-    except Exception as e:
-        pass  # 忽略控制循环错误
+                # 会话结束时将强度设置为最小值（未绑定时发送会一直等待绑定，跳过）
+                try:
+                    if not self.client.not_bind:
+                        await self.set_strength(Channel.A, 0)
+                        await self.set_strength(Channel.B, 0, immediate=True)
+                except:
+                    pass
+
+                if self.recorder:
+                    await self.recorder.close()
+
+
+class SessionManager:
+    """在同一个事件循环中运行多个控制会话，共享同一个只读波形库"""
+
+    def __init__(self, library=waveform_library):
+        self.library = library
+        self.sessions = []
+
+    def new_session(self, recorder=None, index=None):
+        session = DemoSession(self.library, recorder, index)
+        self.sessions.append(session)
+        return session
+
+    async def run(self, uri, session_count, record_path=None):
+        """启动指定数量的会话，任一会话出错不影响其他会话"""
+        recorders = [None] * session_count
+        if record_path:
+            # 多个会话时每个会话录制到单独的文件
+            recorders = [
+                SessionRecorder(record_path if session_count == 1 else f"{record_path}.{index}")
+                for index in range(session_count)
+            ]
+        # 多个会话时二维码标注会话序号，不逐个弹出图片查看器
+        session_runs = [
+            self.new_session(recorder, index if session_count > 1 else None).run(uri)
+            for index, recorder in enumerate(recorders)
+        ]
+
+        # 本地控制接口，供游戏直接控制各会话
+        control_api_task = None
+        if CONTROL_API_PORT:
+            control_api_task = asyncio.create_task(ControlAPI(self.sessions).serve(CONTROL_API_PORT))
 
+        try:
+            results = await asyncio.gather(*session_runs, return_exceptions=True)
+        finally:
+            if control_api_task:
+                control_api_task.cancel()
+        for result in results:
+            if isinstance(result, Exception):
+                raise result
 
-async def main():
-    """主函数"""
-    global client, control_task, current_waveform_index_a, current_waveform_index_b, simple_control
 
+async def main(session_count=1, record_path=None):
+    """主函数"""
     try:
         print("=" * 50)
         print("DG-Lab 简化控制 Demo")
@@ -307,125 +764,44 @@ async def main():
         print("1. A1按钮: 切换到下一个波形")
         print("2. A2按钮: A通道强度+1")
         print("3. A3按钮: A通道强度-1")
-        print("4. B1按钮: 切换到下一个波形")
-        print("5. B2按钮: B通道强度+1")
-        print("6. B3按钮: B通道强度-1")
+        print("4. A4按钮: 切换到上一个波形")
+        print("5. B1按钮: 切换到下一个波形")
+        print("6. B2按钮: B通道强度+1")
+        print("7. B3按钮: B通道强度-1")
+        print("8. B4按钮: 切换到上一个波形")
         print("=" * 50)
-        print(f"初始A通道波形: {available_waveforms[current_waveform_index_a]}")
-        print(f"初始B通道波形: {available_waveforms[current_waveform_index_b]}")
+        if WAVEFORM_FILTER:
+            print(f"波形筛选条件: {WAVEFORM_FILTER}")
+            print(f"符合条件的波形: {waveform_library.catalog.query(**WAVEFORM_FILTER)}")
+        print(f"初始A通道波形: {waveform_library.name_at(waveform_library.index_of(CURRENT_WAVEFORM_A))}")
+        print(f"初始B通道波形: {waveform_library.name_at(waveform_library.index_of(CURRENT_WAVEFORM_B))}")
 
         # 连接到服务端
         try:
-            async with DGLabWSConnect(f'ws://{get_host_ip()}:5678', CONNECTION_TIMEOUT) as ws_client:
-                client = ws_client
-
-                # 获取二维码
-                url = client.get_qrcode()
-                print("请用 DG-Lab App 扫描二维码以连接")
-                print_qrcode(url)
-
-                # 等待绑定
-                await client.bind()
-                print(f"已与 App {client.target_id} 成功绑定")
-
-                # 显示初始状态信息
-                simple_control = SimpleControl()
-                simple_control.print_status()
-
-                # 启动控制任务
-                control_task = asyncio.create_task(control_loop())
-
-                # 处理DG-Lab消息
-                async for data in client.data_generator():
-
-                    # 接收通道强度数据（获取手机上限）
-                    if isinstance(data, StrengthData):
-                        # 直接从手机数据获取上限
-                        a_limit = data.a_limit
-                        b_limit = data.b_limit
-
-                        # 更新控制实例中的上限（只有变化时才打印）
-                        if simple_control:
-                            simple_control.update_limits(a_limit, b_limit)
-
-                    # 接收 App 反馈按钮
-                    elif isinstance(data, FeedbackButton):
-                        print(f"按钮: {data.name}")
-
-                        if data == FeedbackButton.A1:
-                            # A1按钮：切换到下一个波形
-                            current_waveform_index_a = (current_waveform_index_a + 1) % len(available_waveforms)
-                            print(f"A通道切换到下一个波形: {available_waveforms[current_waveform_index_a]}")
-                            await send_waveform(Channel.A)
-
-                        elif data == FeedbackButton.A2:
-                            # A2按钮：A通道强度+1，由set_strength函数处理上限
-                            if simple_control:
-                                simple_control.current_strength_a += 1
-
-                        elif data == FeedbackButton.A3:
-                            # A3按钮：A通道强度-1，确保不低于1
-                            if simple_control:
-                                new_strength = max(simple_control.current_strength_a - 1, 1)
-                                simple_control.current_strength_a = new_strength
-
-                        elif data == FeedbackButton.B1:
-                            # B1按钮：切换到下一个波形
-                            current_waveform_index_b = (current_waveform_index_b + 1) % len(available_waveforms)
-                            print(f"B通道切换到下一个波形: {available_waveforms[current_waveform_index_b]}")
-                            await send_waveform(Channel.B)
-
-                        elif data == FeedbackButton.B2:
-                            # B2按钮：B通道强度+1，由set_strength函数处理上限
-                            if simple_control:
-                                simple_control.current_strength_b += 1
-
-                        elif data == FeedbackButton.B3:
-                            # B3按钮：B通道强度-1，确保不低于1
-                            if simple_control:
-                                new_strength = max(simple_control.current_strength_b - 1, 1)
-                                simple_control.current_strength_b = new_strength
-
-                    # 接收心跳/App断开通知
-                    elif data == RetCode.CLIENT_DISCONNECTED:
-                        print("App 已断开连接，尝试重新绑定...")
-                        await client.rebind()
-                        print("重新绑定成功")
-
-                        # 重新绑定后显示当前状态
-                        if simple_control:
-                            simple_control.print_status()
-
-                # 取消控制任务
-                control_task.cancel()
-                await control_task
+            await SessionManager().run(f'ws://{get_host_ip()}:5678', session_count, record_path)
 
         except ConnectionRefusedError as e:
-            print('连接服务器错误，请确保server.exe已启动')
-            print('找到server.exe文件并双击运行，然后保持窗口打开')
+            console.log('连接服务器错误，请确保server.exe已启动')
+            console.log('找到server.exe文件并双击运行，然后保持窗口打开')
         except Exception as e:
-            print(f"连接错误: {e}")
+            console.log(f"连接错误: {e}")
 
     except Exception as e:
         print(f"程序错误: {e}")
         import traceback
         traceback.print_exc()
-    finally:
-        # 程序结束时将强度设置为最小值
-        try:
-            if client:
-                await set_strength(Channel.A, 0)
-                await set_strength(Channel.B, 0)
-        except:
-            pass
 
 
 if __name__ == "__main__":
     try:
-        asyncio.run(main())
+        # 可选参数：同时控制的 App 数量、会话录制文件路径
+        asyncio.run(main(
+            int(sys.argv[1]) if len(sys.argv) > 1 else 1,
+            sys.argv[2] if len(sys.argv) > 2 else None
+        ))
     except KeyboardInterrupt:
         print("\n程序被用户中断")
     except Exception as e:
         print(f"程序启动错误: {e}")
         import traceback
-        traceback.print_exc()
\ No newline at end of file
+        traceback.print_exc()
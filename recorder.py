@@ -0,0 +1,272 @@
+import asyncio
+import heapq
+import struct
+import sys
+import time
+from collections import Counter
+from enum import IntEnum
+
+from pydglab_ws import StrengthData, FeedbackButton, Channel, StrengthOperationType, RetCode
+
+# 会话录制文件格式：
+#   文件头 MAGIC
+#   每条记录 = 记录头(时间戳毫秒 uint32, 类型 uint8, 数据长度 uint16) + 数据
+MAGIC = b"DGREC\x01"
+RECORD_HEADER = struct.Struct("<IBH")
+FLUSH_SIZE = 64 * 1024    # 缓冲超过该大小时写入文件
+FLUSH_INTERVAL = 1.0      # 距上次写入超过该秒数时写入文件
+SETTLE_STEPS = 8          # 虚拟时钟唤醒等待后让出事件循环的次数，使被唤醒的任务运行到下一次等待
+
+
+class RecordKind(IntEnum):
+    """记录类型，前三种为收到的事件，后三种为发出的指令"""
+    STRENGTH_DATA = 1
+    FEEDBACK = 2
+    RET_CODE = 3
+    ADD_PULSES = 4
+    CLEAR_PULSES = 5
+    SET_STRENGTH = 6
+
+
+INBOUND_KINDS = (RecordKind.STRENGTH_DATA, RecordKind.FEEDBACK, RecordKind.RET_CODE)
+
+
+class SessionRecorder:
+    """只追加的二进制会话录制器，写入先进缓冲区，再交给线程池写文件，不阻塞事件循环"""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "wb")
+        self._file.write(MAGIC)
+        self._buffer = bytearray()
+        self._start = time.monotonic()
+        self._last_flush = self._start
+        self._flush_task = None
+
+    def _append(self, kind, payload: bytes):
+        now = time.monotonic()
+        self._buffer += RECORD_HEADER.pack(int((now - self._start) * 1000), kind, len(payload))
+        self._buffer += payload
+        if (len(self._buffer) >= FLUSH_SIZE or now - self._last_flush >= FLUSH_INTERVAL) \
+                and (self._flush_task is None or self._flush_task.done()):
+            self._last_flush = now
+            self._flush_task = asyncio.ensure_future(self._flush())
+
+    async def _flush(self):
+        if not self._buffer:
+            return
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        await asyncio.get_running_loop().run_in_executor(None, self._file.write, data)
+
+    def record_inbound(self, data):
+        """记录收到的强度数据、反馈按钮或响应码"""
+        if isinstance(data, StrengthData):
+            self._append(RecordKind.STRENGTH_DATA, bytes((data.a, data.b, data.a_limit, data.b_limit)))
+        elif isinstance(data, FeedbackButton):
+            self._append(RecordKind.FEEDBACK, bytes((data.value,)))
+        elif isinstance(data, RetCode):
+            self._append(RecordKind.RET_CODE, struct.pack("<H", data.value))
+
+    def record_add_pulses(self, channel, pulses):
+        payload = bytes((channel.value,)) + bytes(value for pulse in pulses for operation in pulse for value in operation)
+        self._append(RecordKind.ADD_PULSES, payload)
+
+    def record_clear_pulses(self, channel):
+        self._append(RecordKind.CLEAR_PULSES, bytes((channel.value,)))
+
+    def record_set_strength(self, channel, operation_type, value):
+        self._append(RecordKind.SET_STRENGTH, bytes((channel.value, operation_type.value, value)))
+
+    async def close(self):
+        if self._flush_task is not None:
+            await self._flush_task
+        await self._flush()
+        self._file.close()
+
+
+class RecordingClient:
+    """包装终端对象，发出指令时同时写入录制器，其余属性直接转发"""
+
+    def __init__(self, client, recorder: SessionRecorder):
+        self._client = client
+        self._recorder = recorder
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+    async def add_pulses(self, channel, *pulses):
+        await self._client.add_pulses(channel, *pulses)
+        self._recorder.record_add_pulses(channel, pulses)
+
+    async def clear_pulses(self, channel):
+        await self._client.clear_pulses(channel)
+        self._recorder.record_clear_pulses(channel)
+
+    async def set_strength(self, channel, operation_type, value):
+        await self._client.set_strength(channel, operation_type, value)
+        self._recorder.record_set_strength(channel, operation_type, value)
+
+
+def _decode(kind, payload: bytes):
+    if kind == RecordKind.STRENGTH_DATA:
+        a, b, a_limit, b_limit = payload
+        return StrengthData(a=a, b=b, a_limit=a_limit, b_limit=b_limit)
+    elif kind == RecordKind.FEEDBACK:
+        return FeedbackButton(payload[0])
+    elif kind == RecordKind.RET_CODE:
+        return RetCode(struct.unpack("<H", payload)[0])
+    elif kind == RecordKind.ADD_PULSES:
+        values = payload[1:]
+        pulses = tuple(
+            (tuple(values[i:i + 4]), tuple(values[i + 4:i + 8])) for i in range(0, len(values), 8)
+        )
+        return Channel(payload[0]), pulses
+    elif kind == RecordKind.CLEAR_PULSES:
+        return Channel(payload[0])
+    elif kind == RecordKind.SET_STRENGTH:
+        return Channel(payload[0]), StrengthOperationType(payload[1]), payload[2]
+
+
+def read_records(path):
+    """逐条读取录制文件，返回 (时间戳毫秒, 记录类型, 解码后的数据)"""
+    with open(path, "rb") as f:
+        data = f.read()
+    if not data.startswith(MAGIC):
+        raise ValueError(f"不是会话录制文件: {path}")
+    pos = len(MAGIC)
+    while pos + RECORD_HEADER.size <= len(data):
+        timestamp, kind, length = RECORD_HEADER.unpack_from(data, pos)
+        pos += RECORD_HEADER.size
+        payload = data[pos:pos + length]
+        pos += length
+        if len(payload) < length:
+            break  # 录制中断导致的不完整记录
+        yield timestamp, RecordKind(kind), _decode(kind, payload)
+
+
+class ReplayClient:
+    """回放用的终端，不连接服务端，只统计控制逻辑发出的指令"""
+
+    client_id = None
+    target_id = None
+    not_bind = False
+
+    def __init__(self):
+        self.sent = Counter()
+
+    async def add_pulses(self, channel, *pulses):
+        self.sent[RecordKind.ADD_PULSES] += 1
+
+    async def clear_pulses(self, channel):
+        self.sent[RecordKind.CLEAR_PULSES] += 1
+
+    async def set_strength(self, channel, operation_type, value):
+        self.sent[RecordKind.SET_STRENGTH] += 1
+
+    async def rebind(self):
+        return RetCode.SUCCESS
+
+
+class VirtualClock:
+    """回放用的虚拟时钟，会话中的等待按录制的时间戳推进，不占用真实时间"""
+
+    def __init__(self):
+        self.now = 0.0
+        self._sleepers = []  # (唤醒时间, 序号, future) 的最小堆
+        self._seq = 0
+
+    def time(self):
+        return self.now
+
+    async def sleep(self, delay):
+        future = asyncio.get_running_loop().create_future()
+        self._seq += 1
+        heapq.heappush(self._sleepers, (self.now + delay, self._seq, future))
+        await future
+
+    async def settle(self):
+        """让被唤醒或新创建的任务运行到下一次等待"""
+        for _ in range(SETTLE_STEPS):
+            await asyncio.sleep(0)
+
+    async def _wake_next(self):
+        wake_time, _, future = heapq.heappop(self._sleepers)
+        self.now = max(self.now, wake_time)
+        if not future.done():
+            future.set_result(None)
+            await self.settle()
+
+    async def advance_to(self, target):
+        """按时间顺序唤醒 ``target`` 之前到期的等待"""
+        await self.settle()
+        while self._sleepers and self._sleepers[0][0] <= target:
+            await self._wake_next()
+        self.now = max(self.now, target)
+
+    async def run(self, coroutine):
+        """运行协程，协程等待虚拟时钟时继续推进时间，直到协程结束"""
+        task = asyncio.ensure_future(coroutine)
+        await self.settle()
+        while not task.done() and self._sleepers:
+            await self._wake_next()
+        return await task
+
+
+async def replay(path, speed=1.0):
+    """
+    将录制的事件重新输入控制逻辑
+
+    控制循环与波形发送的等待使用虚拟时钟，按录制的时间戳推进，回放结果与倍速无关
+
+    :param speed: 回放倍速，为 ``None`` 时不等待，尽可能快地回放
+    """
+    from demo import DemoSession, console
+
+    clock = VirtualClock()
+    session = DemoSession()
+    session.client = ReplayClient()
+    session.clock = clock.time
+    session.sleep = clock.sleep
+    recorded = Counter()
+    event_count = 0
+    start = time.monotonic()
+
+    for timestamp, kind, data in read_records(path):
+        if session.control_task is None:
+            # 录制中第一条记录在绑定之后，控制循环从这时开始
+            clock.now = timestamp / 1000
+            session.control_task = asyncio.create_task(session.control_loop())
+        if speed is not None:
+            delay = start + timestamp / 1000 / speed - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        await clock.advance_to(timestamp / 1000)
+        if kind not in INBOUND_KINDS:
+            recorded[kind] += 1
+            continue
+        # 处理消息时的等待（如切换波形后的间隔）同样推进虚拟时钟
+        await clock.run(session.handle_data(data))
+        event_count += 1
+
+    if session.control_task is not None:
+        session.control_task.cancel()
+        await session.control_task
+    # 发送合并窗口内尚未发出的强度
+    await session.strength_writer.flush()
+    console.flush()
+    print("=" * 30)
+    print(f"|回放事件数: {event_count}，录制时长 {clock.now:.1f}s，耗时 {time.monotonic() - start:.3f}s")
+    for kind in (RecordKind.ADD_PULSES, RecordKind.CLEAR_PULSES, RecordKind.SET_STRENGTH):
+        print(f"|{kind.name}: 录制 {recorded[kind]}，回放 {session.client.sent[kind]}")
+    print("=" * 30)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("用法: python recorder.py <录制文件> [倍速|fast]")
+    else:
+        replay_speed = 1.0
+        if len(sys.argv) > 2:
+            replay_speed = None if sys.argv[2] == "fast" else float(sys.argv[2])
+        asyncio.run(replay(sys.argv[1], replay_speed))
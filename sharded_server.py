@@ -0,0 +1,345 @@
+import asyncio
+import json
+import multiprocessing
+import os
+import socket
+import sys
+import uuid
+
+from websockets import ConnectionClosed
+from pydglab_ws import RetCode
+from pydglab_ws.enums import MessageDataHead, MessageType
+from pydglab_ws.server import DGLabWSServer
+
+# 多进程分片服务端：K 个工作进程通过 SO_REUSEPORT 共享 5678 端口，
+# 主进程运行本地注册中心（broker），保存 终端/App 所在分片 与 绑定关系，
+# 终端与 App 落在不同分片时，消息经注册中心转发到对方所在分片
+
+HOST = "0.0.0.0"
+PORT = 5678
+HEARTBEAT_INTERVAL = 60
+BROKER_HOST = "127.0.0.1"
+OUTBOX_SIZE = 256  # 每个连接待投递的转发消息上限，超出后丢弃，避免慢连接占满内存
+
+
+def _dump(**frame) -> bytes:
+    return (json.dumps(frame, separators=(",", ":")) + "\n").encode()
+
+
+class ShardBroker:
+    """注册中心，运行在主进程中"""
+
+    def __init__(self):
+        self.id_to_shard = {}          # 客户端ID -> 分片编号
+        self.client_id_to_target_id = {}
+        self.target_id_to_client_id = {}
+        self.shard_writers = {}        # 分片编号 -> StreamWriter
+
+    def _broadcast(self, data: bytes):
+        for writer in self.shard_writers.values():
+            writer.write(data)
+
+    @staticmethod
+    async def _drain(*writers):
+        """等待写缓冲区降到水位线以下，对方分片处理不过来时暂停读取当前分片"""
+        await asyncio.gather(*(writer.drain() for writer in writers), return_exceptions=True)
+
+    def _unbind(self, uuid_str):
+        """移除与该ID相关的绑定关系，返回是否存在绑定"""
+        if target_id := self.client_id_to_target_id.pop(uuid_str, None):
+            self.target_id_to_client_id.pop(target_id, None)
+            self._broadcast(_dump(op="unbound", client=uuid_str, target=target_id))
+            return True
+        if client_id := self.target_id_to_client_id.pop(uuid_str, None):
+            self.client_id_to_target_id.pop(client_id, None)
+            self._broadcast(_dump(op="unbound", client=client_id, target=uuid_str))
+            return True
+        return False
+
+    def _bind(self, client_id, target_id):
+        """与单进程服务端相同的绑定判定，在注册中心内原子执行"""
+        if client_id not in self.id_to_shard or target_id not in self.id_to_shard:
+            return RetCode.TARGET_CLIENT_NOT_FOUND
+        if client_id in self.client_id_to_target_id or target_id in self.target_id_to_client_id:
+            return RetCode.ID_ALREADY_BOUND
+        self.client_id_to_target_id[client_id] = target_id
+        self.target_id_to_client_id[target_id] = client_id
+        self._broadcast(_dump(op="bound", client=client_id, target=target_id))
+        return RetCode.SUCCESS
+
+    async def handle_shard(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """处理一个分片的连接"""
+        shard = None
+        try:
+            while line := await reader.readline():
+                frame = json.loads(line)
+                op = frame["op"]
+                # 绑定关系的修改保持同步执行，写出后再统一等待缓冲区
+                if op == "hello":
+                    shard = frame["shard"]
+                    self.shard_writers[shard] = writer
+                    # 新分片需要同步已有的客户端与绑定关系
+                    for uuid_str in self.id_to_shard:
+                        writer.write(_dump(op="online", id=uuid_str))
+                    for client_id, target_id in self.client_id_to_target_id.items():
+                        writer.write(_dump(op="bound", client=client_id, target=target_id))
+                    await self._drain(writer)
+                elif op == "reg":
+                    self.id_to_shard[frame["id"]] = shard
+                    self._broadcast(_dump(op="online", id=frame["id"]))
+                    await self._drain(*self.shard_writers.values())
+                elif op == "unreg":
+                    if self.id_to_shard.get(frame["id"]) == shard:
+                        self.id_to_shard.pop(frame["id"])
+                        self._unbind(frame["id"])
+                        self._broadcast(_dump(op="offline", id=frame["id"]))
+                        await self._drain(*self.shard_writers.values())
+                elif op == "bind":
+                    code = self._bind(frame["client"], frame["target"])
+                    writer.write(_dump(op="bind_ret", seq=frame["seq"], code=code.value))
+                    await self._drain(*self.shard_writers.values())
+                elif op == "send":
+                    owner = self.id_to_shard.get(frame["id"])
+                    if owner is not None and (owner_writer := self.shard_writers.get(owner)):
+                        owner_writer.write(line)
+                        await self._drain(owner_writer)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            # 分片进程退出，清理它登记的所有客户端
+            if shard is not None:
+                self.shard_writers.pop(shard, None)
+                for uuid_str in [k for k, v in self.id_to_shard.items() if v == shard]:
+                    self.id_to_shard.pop(uuid_str)
+                    self._unbind(uuid_str)
+                    self._broadcast(_dump(op="offline", id=uuid_str))
+            writer.close()
+
+
+class ShardRegistry:
+    """分片进程中的注册中心客户端，维护全局客户端与绑定关系的本地镜像"""
+
+    def __init__(self, shard: int, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.shard = shard
+        self.server = None
+        self.online_ids = set()
+        self._reader = reader
+        self._writer = writer
+        self._bind_seq = 0
+        self._bind_waiters = {}
+        self._reader_task = None
+
+    @classmethod
+    async def connect(cls, shard: int, broker_port: int) -> "ShardRegistry":
+        reader, writer = await asyncio.open_connection(BROKER_HOST, broker_port)
+        registry = cls(shard, reader, writer)
+        writer.write(_dump(op="hello", shard=shard))
+        registry._reader_task = asyncio.create_task(registry._read_loop())
+        return registry
+
+    async def _write(self, data: bytes):
+        self._writer.write(data)
+        await self._writer.drain()
+
+    async def register(self, client_id):
+        self.online_ids.add(client_id)
+        await self._write(_dump(op="reg", id=str(client_id)))
+
+    async def unregister(self, client_id):
+        self.online_ids.discard(client_id)
+        await self._write(_dump(op="unreg", id=str(client_id)))
+
+    async def send(self, client_id, data: str):
+        await self._write(_dump(op="send", id=str(client_id), data=data))
+
+    async def bind(self, client_id, target_id) -> RetCode:
+        self._bind_seq += 1
+        seq = self._bind_seq
+        waiter = self._bind_waiters[seq] = asyncio.get_running_loop().create_future()
+        try:
+            await self._write(_dump(op="bind", seq=seq, client=str(client_id), target=str(target_id)))
+            return RetCode(await waiter)
+        finally:
+            self._bind_waiters.pop(seq, None)
+
+    async def _read_loop(self):
+        while line := await self._reader.readline():
+            frame = json.loads(line)
+            op = frame["op"]
+            if op == "send":
+                # 只放入目标连接的发送队列，慢连接不会阻塞本分片的其他消息
+                self.server.deliver(uuid.UUID(frame["id"]), frame["data"])
+            elif op == "online":
+                self.online_ids.add(uuid.UUID(frame["id"]))
+            elif op == "offline":
+                self.online_ids.discard(uuid.UUID(frame["id"]))
+            elif op == "bound":
+                self.server.mirror_bind(uuid.UUID(frame["client"]), uuid.UUID(frame["target"]))
+            elif op == "unbound":
+                self.server.mirror_unbind(uuid.UUID(frame["client"]), uuid.UUID(frame["target"]))
+            elif op == "bind_ret":
+                if (waiter := self._bind_waiters.get(frame["seq"])) and not waiter.done():
+                    waiter.set_result(frame["code"])
+        print(f"[分片{self.shard}] 与注册中心的连接已断开")
+
+
+class _RemoteWebSocket:
+    """位于其他分片的连接代理，发送的数据经注册中心转发"""
+
+    def __init__(self, registry: ShardRegistry, client_id):
+        self._registry = registry
+        self._client_id = client_id
+
+    async def send(self, data: str):
+        await self._registry.send(self._client_id, data)
+
+
+class _ShardWebSocketMap(dict):
+    """
+    ``uuid_to_ws`` 映射：本分片的连接直接保存，其他分片在线的客户端返回转发代理
+
+    ``items()``/``copy()`` 等只包含本分片连接，因此心跳只发给本分片的客户端
+    """
+
+    def __init__(self, registry: ShardRegistry):
+        super().__init__()
+        self._registry = registry
+
+    def get(self, key, default=None):
+        if key is not None and dict.__contains__(self, key):
+            return dict.__getitem__(self, key)
+        if key in self._registry.online_ids:
+            return _RemoteWebSocket(self._registry, key)
+        return default
+
+    def __getitem__(self, key):
+        if (websocket := self.get(key)) is None:
+            raise KeyError(key)
+        return websocket
+
+    def __contains__(self, key):
+        return dict.__contains__(self, key) or key in self._registry.online_ids
+
+
+class ShardedDGLabWSServer(DGLabWSServer):
+    """一个分片上的 DG-Lab WebSocket 服务端，绑定关系由注册中心统一判定"""
+
+    def __init__(self, host, port, heartbeat_interval, registry: ShardRegistry, **kwargs):
+        super().__init__(host, port, heartbeat_interval, **kwargs)
+        self._registry = registry
+        self._uuid_to_ws = _ShardWebSocketMap(registry)
+        # 客户端 ID -> (待投递的转发消息, 发送任务)
+        self._outboxes = {}
+        registry.server = self
+        self.add_connection_callback("new_connect", lambda client_id, _: registry.register(client_id))
+        self.add_connection_callback("disconnect", self._on_disconnect)
+
+    async def _on_disconnect(self, client_id, _):
+        if outbox := self._outboxes.pop(client_id, None):
+            outbox[1].cancel()
+        await self._registry.unregister(client_id)
+
+    def mirror_bind(self, client_id, target_id):
+        self._client_id_to_target_id[client_id] = target_id
+        self._target_id_to_client_id[target_id] = client_id
+
+    def mirror_unbind(self, client_id, target_id):
+        self._client_id_to_target_id.pop(client_id, None)
+        self._target_id_to_client_id.pop(target_id, None)
+
+    def deliver(self, client_id, data: str):
+        """投递其他分片转发来的消息，每个连接按顺序发送，互不阻塞"""
+        if (websocket := dict.get(self._uuid_to_ws, client_id)) is None:
+            return
+        if (outbox := self._outboxes.get(client_id)) is None:
+            queue = asyncio.Queue(OUTBOX_SIZE)
+            outbox = self._outboxes[client_id] = (queue, asyncio.create_task(self._send_outbox(websocket, queue)))
+        try:
+            outbox[0].put_nowait(data)
+        except asyncio.QueueFull:
+            print(f"[分片{self._registry.shard}] 连接 {client_id} 发送过慢，丢弃转发消息")
+
+    @staticmethod
+    async def _send_outbox(websocket, queue: asyncio.Queue):
+        try:
+            while True:
+                await websocket.send(await queue.get())
+        except ConnectionClosed:
+            pass
+
+    @staticmethod
+    async def _handle_bind(self: "ShardedDGLabWSServer", message, websocket=None):
+        """响应关系绑定消息，绑定判定交给注册中心，保证跨分片的唯一性"""
+        if message.message == MessageDataHead.DG_LAB \
+                and message.client_id is not None \
+                and message.target_id is not None:
+            msg_to_send = message.model_copy()
+            msg_to_send.message = await self._registry.bind(message.client_id, message.target_id)
+            if msg_to_send.message == RetCode.SUCCESS:
+                # 不等待注册中心广播，避免绑定后第一条消息被判定为非绑定关系
+                self.mirror_bind(message.client_id, message.target_id)
+
+            await self._send(msg_to_send, self._uuid_to_ws.get(message.client_id), websocket)
+
+            if callback_set := self._message_type_to_callbacks.get(MessageType.BIND):
+                for callback in callback_set:
+                    callback_ret = callback(message, msg_to_send.message == RetCode.SUCCESS)
+                    if asyncio.iscoroutine(callback_ret):
+                        await callback_ret
+
+
+async def _worker_main(shard: int, broker_port: int):
+    registry = await ShardRegistry.connect(shard, broker_port)
+    async with ShardedDGLabWSServer(HOST, PORT, HEARTBEAT_INTERVAL, registry, reuse_port=True) as server:
+        print(f"[分片{shard}] 进程 {os.getpid()} 已启动")
+        while True:
+            print(f"[分片{shard}] 本分片连接：{list(server.uuid_to_ws.keys())}")
+            await asyncio.sleep(5)
+
+
+def _run_worker(shard: int, broker_port: int):
+    try:
+        asyncio.run(_worker_main(shard, broker_port))
+    except KeyboardInterrupt:
+        pass
+
+
+async def _broker_main(broker_socket: socket.socket):
+    broker = ShardBroker()
+    async with await asyncio.start_server(broker.handle_shard, sock=broker_socket):
+        while True:
+            print(f"在线分片：{sorted(broker.shard_writers.keys())}")
+            print(f"关系绑定：{broker.client_id_to_target_id}")
+            await asyncio.sleep(5)
+
+
+def main(workers: int):
+    if not hasattr(socket, "SO_REUSEPORT"):
+        # Windows 等平台不支持端口共享，退回单进程服务端
+        print("当前系统不支持 SO_REUSEPORT，请使用 server.py 单进程运行")
+        return
+
+    broker_socket = socket.create_server((BROKER_HOST, 0))
+    broker_port = broker_socket.getsockname()[1]
+
+    context = multiprocessing.get_context("spawn")
+    processes = [
+        context.Process(target=_run_worker, args=(shard, broker_port), daemon=True)
+        for shard in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    print(f"已启动 {workers} 个分片进程，共享端口 {PORT}")
+
+    try:
+        asyncio.run(_broker_main(broker_socket))
+    finally:
+        for process in processes:
+            process.terminate()
+
+
+if __name__ == "__main__":
+    try:
+        main(int(sys.argv[1]) if len(sys.argv) > 1 else os.cpu_count() or 1)
+    except KeyboardInterrupt:
+        print("\n服务端已停止")
@@ -0,0 +1,71 @@
+import atexit
+import queue
+import sys
+import threading
+import time
+
+LOG_INTERVAL = 0.2  # 两次输出之间的最小间隔（秒）
+
+
+class StatusLogger:
+    """
+    限速的后台控制台输出
+
+    输出在后台线程中写入终端，事件循环不会因终端输出而阻塞；
+    普通日志按顺序输出，状态信息只保留最新的一份，间隔内多次更新只打印一次
+    """
+
+    def __init__(self, interval=LOG_INTERVAL, stream=None):
+        self.interval = interval
+        self.stream = stream or sys.stdout
+        self._lines = queue.SimpleQueue()
+        self._status = None
+        self._lock = threading.Lock()
+        # 后台线程与主线程（退出时、回放结束时）都可能调用 flush，写出需要互斥，保证顺序
+        self._write_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def _ensure_thread(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="StatusLogger", daemon=True)
+            self._thread.start()
+            atexit.register(self.flush)
+
+    def log(self, text: str):
+        """输出一行日志"""
+        self._lines.put(text)
+        self._ensure_thread()
+        self._wakeup.set()
+
+    def status(self, text: str):
+        """更新状态信息，只打印间隔内的最后一份"""
+        with self._lock:
+            self._status = text
+        self._ensure_thread()
+        self._wakeup.set()
+
+    def flush(self):
+        """立即写出所有待输出内容"""
+        with self._write_lock:
+            output = []
+            while True:
+                try:
+                    output.append(self._lines.get_nowait())
+                except queue.Empty:
+                    break
+            with self._lock:
+                if self._status is not None:
+                    output.append(self._status)
+                    self._status = None
+            if output:
+                self.stream.write("\n".join(output) + "\n")
+                self.stream.flush()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait()
+            self._wakeup.clear()
+            self.flush()
+            # 限速：输出后至少间隔一段时间，期间的状态更新合并
+            time.sleep(self.interval)
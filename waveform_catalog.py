@@ -0,0 +1,61 @@
+from bisect import bisect_left, bisect_right
+
+# 波形特征：
+#   duration  时长（秒），每帧100ms
+#   mean      平均强度
+#   peak      最大强度
+#   freq_min  最低频率（只统计有输出的部分）
+#   freq_max  最高频率
+#   energy    能量，强度平方对时间的积分，强度按100归一化（秒）
+FEATURES = ("duration", "mean", "peak", "freq_min", "freq_max", "energy")
+
+
+def compute_features(frames):
+    """计算一个波形的特征，每帧包含4个25ms的频率与强度"""
+    frequencies = [value for frequency, _ in frames for value in frequency]
+    intensities = [value for _, intensity in frames for value in intensity]
+    active_frequencies = [f for f, i in zip(frequencies, intensities) if i > 0] or [0]
+    return {
+        "duration": round(len(frames) * 0.1, 1),
+        "mean": sum(intensities) / len(intensities) if intensities else 0,
+        "peak": max(intensities, default=0),
+        "freq_min": min(active_frequencies),
+        "freq_max": max(active_frequencies),
+        "energy": sum(i * i for i in intensities) / 10000 * 0.025,
+    }
+
+
+class WaveformCatalog:
+    """
+    波形特征目录，特征在创建时计算一次，每个特征按数值排序建立索引
+
+    示例：``catalog.query(peak=(None, 60), duration=(5, 10))`` 查找最大强度不超过60、时长5~10秒的波形
+    """
+
+    def __init__(self, frames_by_name):
+        self.names = tuple(frames_by_name.keys())
+        self.features = {name: compute_features(frames) for name, frames in frames_by_name.items()}
+        # 特征 -> (排序后的数值, 对应的波形名称)
+        self._index = {}
+        for feature in FEATURES:
+            pairs = sorted((self.features[name][feature], name) for name in self.names)
+            self._index[feature] = ([value for value, _ in pairs], [name for _, name in pairs])
+
+    def query(self, **ranges):
+        """
+        按特征范围查找波形，范围为 (下限, 上限)，包含边界，``None`` 表示不限制
+
+        :return: 符合全部条件的波形名称，按波形库中的顺序排列
+        """
+        matched = None
+        for feature, (low, high) in ranges.items():
+            if feature not in self._index:
+                raise KeyError(f"未知的波形特征: {feature}")
+            values, names = self._index[feature]
+            start = 0 if low is None else bisect_left(values, low)
+            end = len(values) if high is None else bisect_right(values, high)
+            found = set(names[start:end])
+            matched = found if matched is None else matched & found
+        if matched is None:
+            return list(self.names)
+        return [name for name in self.names if name in matched]